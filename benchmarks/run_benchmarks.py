@@ -0,0 +1,434 @@
+"""Benchmarks of the hot paths of `tfutils`, runnable offline on CPU.
+
+The results are stored in a JSON file, keyed by the commit of the working
+tree, and compared with those of a baseline commit. Exits with status 1 if
+any benchmark is slower than its baseline by more than the allowed
+regression.
+
+Examples:
+  $ python benchmarks/run_benchmarks.py
+  $ python benchmarks/run_benchmarks.py --filter tfrecord --repeats 10
+  $ python benchmarks/run_benchmarks.py --baseline <commit> \
+        --max-regression 0.2
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import subprocess
+import collections
+
+# Benchmarks on CPU only, and against the `tfutils` of this working tree.
+os.environ['CUDA_VISIBLE_DEVICES'] = ''
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import numpy as np  # noqa:E402
+from tfutils.pyutils import LazyModule, chunck  # noqa:E402
+from tfutils.dataset import (  # noqa:E402
+    int64_feature, bytes_feature, float_list_feature)
+from tfutils.monte_carlo_integral import monte_carlo_integrate  # noqa:E402
+from tfutils.graph import get_dependent_variables, strip_consts  # noqa:E402
+from tfutils.nn import residual_block_wrapper  # noqa:E402
+from tfutils.tensorboard import variable_summaries  # noqa:E402
+from tfutils.train import (  # noqa:E402
+    save_variables, restore_variables, create_cpu_session, smear, ALL_VARS)
+
+tf = LazyModule('tensorflow')
+
+
+DEFAULT_RESULTS_PATH = os.path.join(ROOT_DIR, 'benchmarks', 'results.json')
+SEED = 42
+
+Benchmark = collections.namedtuple('Benchmark', ['setup_fn', 'fresh_setup'])
+
+BENCHMARKS = collections.OrderedDict()
+
+
+def benchmark(name, fresh_setup=False):
+  """Decorator that registers a benchmark.
+
+  The decorated function sets up the benchmark, and returns the callable to
+  be timed. It takes an instance of `contextlib.ExitStack`, by which the
+  resources it creates, like sessions and temporary directories, are
+  released after the benchmark.
+
+  Args:
+    name: String.
+    fresh_setup: Boolean. If `True`, the benchmark is set up afresh before
+      each call of the timed callable, e.g. since the call grows the graph,
+      so that the timing does not depend on the number of repeats.
+  """
+  def decorator(setup_fn):
+    BENCHMARKS[name] = Benchmark(setup_fn, fresh_setup)
+    return setup_fn
+  return decorator
+
+
+def create_session(exit_stack, graph):
+  """Creates a single-threaded session on CPU, for reproducible timing."""
+  return exit_stack.enter_context(
+      create_cpu_session(intra_op_threads=1, inter_op_threads=1,
+                         graph=graph))
+
+
+def make_examples(n_examples, n_floats=32):
+  """Returns list of `tf.train.Example` instances made by the helpers of
+  `tfutils.dataset`."""
+  random = np.random.RandomState(SEED)
+  examples = []
+  for i in range(n_examples):
+    features = {
+        'id': int64_feature(i),
+        'name': bytes_feature('example_{}'.format(i).encode('utf-8')),
+        'values': float_list_feature(random.randn(n_floats).tolist()),
+    }
+    examples.append(tf.train.Example(
+        features=tf.train.Features(feature=features)))
+  return examples
+
+
+@benchmark('tfrecord_encode')
+def bench_tfrecord_encode(exit_stack):
+  def run():
+    for example in make_examples(1000):
+      example.SerializeToString()
+  return run
+
+
+@benchmark('tfrecord_write')
+def bench_tfrecord_write(exit_stack):
+  serialized = [example.SerializeToString()
+                for example in make_examples(1000)]
+  temp_dir = exit_stack.enter_context(tempfile.TemporaryDirectory())
+  path = os.path.join(temp_dir, 'data.tfrecord')
+
+  def run():
+    with tf.python_io.TFRecordWriter(path) as writer:
+      for s in serialized:
+        writer.write(s)
+  return run
+
+
+@benchmark('tfrecord_read')
+def bench_tfrecord_read(exit_stack):
+  temp_dir = exit_stack.enter_context(tempfile.TemporaryDirectory())
+  path = os.path.join(temp_dir, 'data.tfrecord')
+  with tf.python_io.TFRecordWriter(path) as writer:
+    for example in make_examples(1000):
+      writer.write(example.SerializeToString())
+
+  graph = tf.Graph()
+  with graph.as_default():
+    feature_spec = {
+        'id': tf.FixedLenFeature([], tf.int64),
+        'name': tf.FixedLenFeature([], tf.string),
+        'values': tf.FixedLenFeature([32], tf.float32),
+    }
+    dataset = tf.data.TFRecordDataset(path)
+    dataset = dataset.map(
+        lambda s: tf.parse_single_example(s, feature_spec))
+    dataset = dataset.batch(100)
+    iterator = dataset.make_initializable_iterator()
+    next_batch = iterator.get_next()
+  sess = create_session(exit_stack, graph)
+
+  def run():
+    sess.run(iterator.initializer)
+    while True:
+      try:
+        sess.run(next_batch)
+      except tf.errors.OutOfRangeError:
+        break
+  return run
+
+
+def register_monte_carlo_integrate(n_samples):
+
+  @benchmark('monte_carlo_integrate_{}'.format(n_samples))
+  def bench_monte_carlo_integrate(exit_stack):
+    graph = tf.Graph()
+    with graph.as_default():
+      tf.set_random_seed(SEED)
+      samples = tf.random_uniform([n_samples, 16])
+      mc_int = monte_carlo_integrate(tf.square(samples), axes=[0])
+      fetches = [mc_int.value, mc_int.error]
+    sess = create_session(exit_stack, graph)
+    return lambda: sess.run(fetches)
+
+
+for _n_samples in (10 ** 3, 10 ** 5, 10 ** 6):
+  register_monte_carlo_integrate(_n_samples)
+
+
+@benchmark('get_dependent_variables')
+def bench_get_dependent_variables(exit_stack):
+  graph = tf.Graph()
+  with graph.as_default():
+    # A deep chain of 100 layers, each of which depends on 10 variables
+    # through 10 ops.
+    x = tf.zeros([8, 8])
+    for i in range(100):
+      with tf.variable_scope('layer_{}'.format(i)):
+        for j in range(10):
+          var = tf.get_variable('var_{}'.format(j), shape=[8, 8])
+          x = tf.tanh(tf.matmul(x, var))
+
+  def run():
+    with graph.as_default():
+      get_dependent_variables(x)
+  return run
+
+
+@benchmark('strip_consts')
+def bench_strip_consts(exit_stack):
+  graph = tf.Graph()
+  with graph.as_default():
+    random = np.random.RandomState(SEED)
+    for i in range(200):
+      tf.constant(random.randn(64, 64).astype('float32'))
+      tf.constant(float(i))
+  graph_def = graph.as_graph_def()
+  return lambda: strip_consts(graph_def)
+
+
+# Each call of `save_variables()` and `restore_variables()` adds a saver to
+# the graph, thus set up afresh.
+@benchmark('save_restore', fresh_setup=True)
+def bench_save_restore(exit_stack):
+  temp_dir = exit_stack.enter_context(tempfile.TemporaryDirectory())
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.set_random_seed(SEED)
+    for i in range(20):
+      tf.get_variable('var_{}'.format(i), shape=[256, 256])
+    init_op = tf.global_variables_initializer()
+  sess = create_session(exit_stack, graph)
+  sess.run(init_op)
+
+  def run():
+    with graph.as_default():
+      save_variables(sess, ALL_VARS, temp_dir)
+      restore_variables(sess, ALL_VARS, temp_dir)
+  return run
+
+
+@benchmark('smear')
+def bench_smear(exit_stack):
+  values = np.random.RandomState(SEED).randn(10000).tolist()
+  return lambda: smear(values, window_size=100)
+
+
+@benchmark('chunck')
+def bench_chunck(exit_stack):
+  elems = list(range(10 ** 5))
+  return lambda: list(chunck(64, elems))
+
+
+def register_variable_summaries(mode, **kwargs):
+
+  @benchmark('variable_summaries_{}'.format(mode))
+  def bench_variable_summaries(exit_stack):
+    graph = tf.Graph()
+    with graph.as_default():
+      tf.set_random_seed(SEED)
+      global_step = tf.train.get_or_create_global_step()
+      for i in range(50):
+        var = tf.get_variable('var_{}'.format(i), shape=[256, 256])
+        variable_summaries(var, name='var_{}'.format(i),
+                           global_step=global_step, **kwargs)
+      summary_op = tf.summary.merge_all()
+      init_op = tf.global_variables_initializer()
+    sess = create_session(exit_stack, graph)
+    sess.run(init_op)
+    return lambda: sess.run(summary_op)
+
+
+# Comparing the modes of `variable_summaries()`, on 50 variables of 64K
+# components. The global step stays zero, so the rate-limited summaries are
+# computed in each run as well.
+for _mode, _kwargs in (
+    ('default', {}),
+    ('fused', {'fused': True}),
+    ('fused_subsampled', {'fused': True, 'histogram_sample_size': 1024}),
+    ('fused_subsampled_rate_limited',
+     {'fused': True, 'histogram_sample_size': 1024, 'every_n_steps': 100}),
+):
+  register_variable_summaries(_mode, **_kwargs)
+
+
+def register_residual_block_wrapper(strategy, ishape, oshape, projection):
+
+  @benchmark('residual_block_wrapper_{}'.format(strategy))
+  def bench_residual_block_wrapper(exit_stack):
+    graph = tf.Graph()
+    with graph.as_default():
+      tf.set_random_seed(SEED)
+      # Variables, instead of constants, so that nothing is folded.
+      inputs = tf.get_variable('inputs', shape=ishape)
+      outputs = tf.get_variable('outputs', shape=oshape)
+      result = residual_block_wrapper(inputs, outputs, projection)
+      fetch = tf.reduce_sum(result)
+      init_op = tf.global_variables_initializer()
+    sess = create_session(exit_stack, graph)
+    sess.run(init_op)
+    return lambda: sess.run(fetch)
+
+
+# Comparing the projection strategies of `residual_block_wrapper()`, as
+# `(strategy, input shape, output shape, projection)`. The "learned_*" ones
+# are the learned counterparts of the cheaper ones above them.
+for _args in (
+    ('identity', [64, 16, 16, 32], [64, 16, 16, 32], 'auto'),
+    ('zero_pad', [64, 16, 16, 32], [64, 16, 16, 64], 'auto'),
+    ('learned_channels', [64, 16, 16, 32], [64, 16, 16, 64], 'learned'),
+    ('subsample_zero_pad', [64, 16, 16, 16], [64, 8, 8, 32], 'auto'),
+    ('learned_trailing_axes', [64, 16, 16, 16], [64, 8, 8, 32], 'learned'),
+    ('subsample_learned_channels', [64, 16, 16, 64], [64, 8, 8, 32],
+     'auto'),
+):
+  register_residual_block_wrapper(*_args)
+
+
+def time_benchmark(bench, repeats, warmup):
+  """Returns the timing, in seconds, of the benchmark `bench`. The set-up
+  is not timed.
+
+  Args:
+    bench: A `Benchmark` instance, as registered by `benchmark()`.
+    repeats: Positive integer.
+    warmup: Non-negative integer.
+
+  Returns:
+    Dictionary with keys "median", "min" and "repeats".
+  """
+  def time_call(run):
+    start = time.perf_counter()
+    run()
+    return time.perf_counter() - start
+
+  timings = []
+  if bench.fresh_setup:
+    for i in range(warmup + repeats):
+      with contextlib.ExitStack() as exit_stack:
+        timing = time_call(bench.setup_fn(exit_stack))
+      if i >= warmup:
+        timings.append(timing)
+
+  else:
+    with contextlib.ExitStack() as exit_stack:
+      run = bench.setup_fn(exit_stack)
+      for _ in range(warmup):
+        run()
+      for _ in range(repeats):
+        timings.append(time_call(run))
+  return {'median': float(np.median(timings)),
+          'min': min(timings),
+          'repeats': repeats}
+
+
+def get_commit():
+  """Returns the commit of the working tree, suffixed by "-dirty" if there
+  is any uncommitted change of the tracked files."""
+  def git(*args):
+    return subprocess.check_output(('git',) + args, cwd=ROOT_DIR).decode()
+
+  commit = git('rev-parse', '--short', 'HEAD').strip()
+  if git('status', '--porcelain', '--untracked-files=no').strip():
+    commit += '-dirty'
+  return commit
+
+
+def load_results(path):
+  if not os.path.exists(path):
+    return collections.OrderedDict()
+  with open(path) as f:
+    return json.load(f, object_pairs_hook=collections.OrderedDict)
+
+
+def dump_results(results, path):
+  with open(path, 'w') as f:
+    json.dump(results, f, indent=2)
+
+
+def get_regressions(current, baseline, max_regression):
+  """Returns list of `(name, current_median, baseline_median)` for the
+  benchmarks whose median timing exceeds that of baseline by more than the
+  fraction `max_regression`."""
+  regressions = []
+  for name, timing in current.items():
+    if name not in baseline:
+      continue
+    baseline_median = baseline[name]['median']
+    if timing['median'] > baseline_median * (1 + max_regression):
+      regressions.append((name, timing['median'], baseline_median))
+  return regressions
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--results', default=DEFAULT_RESULTS_PATH,
+                      help='JSON file of the results, keyed by commit.')
+  parser.add_argument('--baseline', default=None,
+                      help='Commit to compare with. Defaults to the latest '
+                           'other commit in the results.')
+  parser.add_argument('--max-regression', type=float, default=0.1,
+                      help='Allowed fraction of slow-down of the median.')
+  parser.add_argument('--filter', default='',
+                      help='Runs only the benchmarks whose name contains it.')
+  parser.add_argument('--repeats', type=int, default=5)
+  parser.add_argument('--warmup', type=int, default=1)
+  parser.add_argument('--no-save', action='store_true',
+                      help='Does not store the results.')
+  args = parser.parse_args(argv)
+
+  commit = get_commit()
+  current = collections.OrderedDict()
+  for name, bench in BENCHMARKS.items():
+    if args.filter not in name:
+      continue
+    np.random.seed(SEED)
+    current[name] = time_benchmark(bench, args.repeats, args.warmup)
+    print('{:<36} median {:.6f} s, min {:.6f} s'.format(
+        name, current[name]['median'], current[name]['min']))
+
+  results = load_results(args.results)
+  baseline_commit = args.baseline
+  if baseline_commit is None:
+    other_commits = [c for c in results if c != commit]
+    if other_commits:
+      baseline_commit = other_commits[-1]
+
+  exit_code = 0
+  if baseline_commit is not None:
+    if baseline_commit not in results:
+      print('=> No results of the baseline commit {}.'
+            .format(baseline_commit))
+      exit_code = 1
+    else:
+      regressions = get_regressions(current, results[baseline_commit],
+                                    args.max_regression)
+      for name, median, baseline_median in regressions:
+        print('=> Regression of {}: {:.6f} s against {:.6f} s of {}.'
+              .format(name, median, baseline_median, baseline_commit))
+      if regressions:
+        exit_code = 1
+      else:
+        print('=> No regression against {}.'.format(baseline_commit))
+
+  if not args.no_save:
+    # Pops so that the latest run goes last, keeping the results of the
+    # benchmarks filtered out.
+    timings = results.pop(commit, collections.OrderedDict())
+    timings.update(current)
+    results[commit] = timings
+    dump_results(results, args.results)
+  return exit_code
+
+
+if __name__ == '__main__':
+  sys.exit(main())
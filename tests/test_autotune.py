@@ -0,0 +1,107 @@
+"""Tests of the cache logic of `autotune_cpu_session()`, without
+TensorFlow, by faking the sessions and the host fingerprint."""
+
+import os
+import json
+
+import pytest
+
+from tfutils import train
+
+
+class FakeSession(object):
+    """Stands for `tf.Session`, recording its number of inter-op
+    threads."""
+
+    def __init__(self, intra_op_threads, inter_op_threads, **kwargs):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+@pytest.fixture
+def benchmarked(monkeypatch):
+    """Fakes the sessions and the host fingerprint, and returns the list of
+    the numbers of inter-op threads that have been benchmarked."""
+    benchmarked = []
+
+    def benchmark_step_fn(session, *args):
+        benchmarked.append(session.inter_op_threads)
+        return float(session.inter_op_threads == 2)  # the best is 2.
+
+    monkeypatch.setattr(train, 'create_cpu_session', FakeSession)
+    monkeypatch.setattr(train, 'get_host_fingerprint', lambda: 'host')
+    monkeypatch.setattr(train, '_benchmark_step_fn', benchmark_step_fn)
+    return benchmarked
+
+
+def autotune(cache_path, intra_op_threads=0):
+    return train.autotune_cpu_session(
+        step_fn=None, intra_op_threads=intra_op_threads,
+        candidates=[1, 2, 4], cache_path=cache_path)
+
+
+def test_cache_hit_skips_benchmarking(tmpdir, benchmarked):
+    cache_path = str(tmpdir.join('cache.json'))
+    assert autotune(cache_path).inter_op_threads == 2
+    assert benchmarked == [1, 2, 4]
+
+    assert autotune(cache_path).inter_op_threads == 2
+    assert benchmarked == [1, 2, 4]
+
+
+def test_cache_key_includes_intra_op_threads(tmpdir, benchmarked):
+    cache_path = str(tmpdir.join('cache.json'))
+    autotune(cache_path, intra_op_threads=1)
+    autotune(cache_path, intra_op_threads=2)
+    assert benchmarked == [1, 2, 4] * 2
+
+    with open(cache_path) as f:
+        cache = json.load(f)
+    assert sorted(cache) == ['host/intra_op_threads=1',
+                             'host/intra_op_threads=2']
+
+
+def test_corrupted_cache_is_retuned(tmpdir, benchmarked):
+    cache_path = str(tmpdir.join('cache.json'))
+    with open(cache_path, 'w') as f:
+        f.write('{"host/intra_op_threads=0": {"inter_op_th')
+
+    assert autotune(cache_path).inter_op_threads == 2
+    assert benchmarked == [1, 2, 4]
+    with open(cache_path) as f:
+        assert json.load(f)['host/intra_op_threads=0']['inter_op_threads'] == 2
+
+
+def test_empty_candidates(benchmarked):
+    with pytest.raises(ValueError):
+        train.autotune_cpu_session(step_fn=None, candidates=[],
+                                   cache_path=None)
+
+
+def test_dump_autotune_cache_is_atomic(tmpdir, monkeypatch):
+    cache_path = str(tmpdir.join('cache.json'))
+    train._dump_autotune_cache({'old': 1}, cache_path)
+
+    replaced = []
+
+    def replace(src, dst):
+        # The cache is never opened for writing in place.
+        with open(dst) as f:
+            assert json.load(f) == {'old': 1}
+        replaced.append((src, dst))
+        os_replace(src, dst)
+
+    os_replace = os.replace
+    monkeypatch.setattr(os, 'replace', replace)
+    train._dump_autotune_cache({'new': 2}, cache_path)
+
+    assert len(replaced) == 1 and replaced[0][1] == cache_path
+    with open(cache_path) as f:
+        assert json.load(f) == {'new': 2}
+    assert tmpdir.listdir() == [tmpdir.join('cache.json')]
@@ -0,0 +1,40 @@
+import os
+import sys
+import subprocess
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('tensorflow', 'tensorflow_probability', 'IPython')
+
+
+def get_imported_heavy_modules(code):
+    """Runs the `code` in a fresh interpreter, and returns the heavy modules
+    that have been imported thereafter."""
+    code += ('\nimport sys\n'
+             'print(",".join(m for m in {} if m in sys.modules))'
+             .format(HEAVY_MODULES))
+    output = subprocess.check_output([sys.executable, '-c', code],
+                                     cwd=ROOT_DIR)
+    return [m for m in output.decode().strip().split(',') if m]
+
+
+def test_import_package():
+    assert get_imported_heavy_modules('import tfutils') == []
+
+
+def test_import_pyutils():
+    code = ('import tfutils\n'
+            'list(tfutils.pyutils.chunck(2, range(5)))')
+    assert get_imported_heavy_modules(code) == []
+
+
+def test_import_train_smear():
+    code = ('from tfutils.train import smear\n'
+            'smear([1., 2., 3.], window_size=2)')
+    assert get_imported_heavy_modules(code) == []
+
+
+def test_import_tf_modules():
+    code = ('from tfutils import dataset, distribution, graph, '
+            'monte_carlo_integral, nn, tensorboard, train')
+    assert get_imported_heavy_modules(code) == []
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if not hasattr(tf, 'Session'):
+    pytest.skip('The TensorFlow 1.x API is required.',
+                allow_module_level=True)
+
+from tfutils.nn import residual_block_wrapper  # noqa:E402
+
+
+def get_shortcut(ishape, oshape, projection='auto'):
+    """Returns the values of the inputs and of the shortcut, with the
+    outputs being zeros, and the number of the trainable weights."""
+    values = np.random.RandomState(0).randn(*ishape).astype('float32')
+    with tf.Graph().as_default():
+        inputs = tf.constant(values)
+        outputs = tf.zeros(oshape)
+        shortcut = residual_block_wrapper(inputs, outputs, projection)
+        assert shortcut.get_shape().as_list() == oshape
+        n_weights = sum(int(np.prod(var.get_shape().as_list()))
+                        for var in tf.trainable_variables())
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            return values, sess.run(shortcut), n_weights
+
+
+def test_identity():
+    values, shortcut, n_weights = get_shortcut([2, 5, 5, 3], [2, 5, 5, 3])
+    np.testing.assert_array_equal(shortcut, values)
+    assert n_weights == 0
+
+
+def test_zero_pad():
+    values, shortcut, n_weights = get_shortcut([2, 5, 5, 3], [2, 5, 5, 4])
+    np.testing.assert_array_equal(shortcut[..., :3], values)
+    np.testing.assert_array_equal(shortcut[..., 3:], 0)
+    assert n_weights == 0
+
+
+@pytest.mark.parametrize('isize,osize,stride', [
+    (8, 4, 2),  # "same" and "valid".
+    (7, 4, 2),  # "same", i.e. ceiling.
+    (9, 4, 2),  # "valid", i.e. floor.
+    (10, 3, 4),  # "same", with the last position not at the end.
+])
+def test_subsample(isize, osize, stride):
+    values, shortcut, n_weights = get_shortcut([2, isize, isize, 3],
+                                               [2, osize, osize, 3])
+    np.testing.assert_array_equal(
+        shortcut, values[:, ::stride, ::stride][:, :osize, :osize])
+    assert n_weights == 0
+
+
+def test_channel_shrink():
+    _, _, n_weights = get_shortcut([2, 8, 8, 6], [2, 4, 4, 3])
+    assert n_weights == 6 * 3  # the channels only.
+
+
+@pytest.mark.parametrize('ishape,oshape', [
+    ([2, 5, 5, 3], [2, 4, 4, 3]),  # no stride maps 5 to 4.
+    ([2, 4, 4, 3], [2, 8, 8, 3]),  # upsampling.
+    ([2, 4, 4, 3], [2, 4, 3]),  # ranks differ.
+])
+def test_rejected(ishape, oshape):
+    with pytest.raises(ValueError, match='learned'):
+        get_shortcut(ishape, oshape)
+
+
+def test_learned():
+    _, _, n_weights = get_shortcut([2, 5, 5, 3], [2, 4, 4, 3], 'learned')
+    assert n_weights == (5 * 5 * 3) * (4 * 4 * 3)
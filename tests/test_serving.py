@@ -0,0 +1,130 @@
+import time
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from tfutils.serving import BatchingServer, ServingMetrics, generate_load
+
+
+class FakeSession(object):
+    """Stands for `tf.Session`, doubling the input `x` as the output `y`,
+    and recording the size of each batch it runs."""
+
+    def __init__(self, delay=0., fail_on=None):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.batch_sizes = []
+        self._lock = threading.Lock()
+
+    def run(self, fetches, feed_dict):
+        x = feed_dict['x:0']
+        with self._lock:
+            self.batch_sizes.append(len(x))
+        time.sleep(self.delay)
+        if self.fail_on is not None and (x == self.fail_on).any():
+            raise RuntimeError('Failed on purpose.')
+        return {name: 2 * x for name in fetches}
+
+
+def create_server(session, **kwargs):
+    return BatchingServer(session, {'x': 'x:0'}, {'y': 'y:0'},
+                          input_shapes={'x': [3]}, **kwargs)
+
+
+def test_batching_and_splitting():
+    session = FakeSession()
+    with create_server(session, max_batch_size=8,
+                       max_queue_delay=0.5) as server:
+        futures = [server.submit({'x': np.full(3, i)}) for i in range(20)]
+        results = [future.result(timeout=5) for future in futures]
+
+    for i, result in enumerate(results):
+        np.testing.assert_array_equal(result['y'], np.full(3, 2 * i))
+    assert max(session.batch_sizes) == 8
+    assert sum(session.batch_sizes) == 20
+    assert server.get_metrics()['mean_batch_size'] > 1
+
+
+def test_async_front_end():
+    session = FakeSession()
+
+    async def predict_all(server):
+        return await asyncio.gather(*[
+            server.predict_async({'x': np.full(3, i)}) for i in range(10)])
+
+    with create_server(session, max_batch_size=4) as server:
+        results = asyncio.run(predict_all(server))
+
+    for i, result in enumerate(results):
+        np.testing.assert_array_equal(result['y'], np.full(3, 2 * i))
+
+
+def test_malformed_request_fails_alone():
+    session = FakeSession()
+    with create_server(session, max_batch_size=8,
+                       max_queue_delay=0.1) as server:
+        valid = server.submit({'x': np.ones(3)})
+        missing = server.submit({'z': np.ones(3)})
+        misshaped = server.submit({'x': np.ones(4)})
+
+        np.testing.assert_array_equal(valid.result(timeout=5)['y'],
+                                      np.full(3, 2.))
+        with pytest.raises(KeyError):
+            missing.result(timeout=5)
+        with pytest.raises(ValueError):
+            misshaped.result(timeout=5)
+
+
+def test_session_error_propagates():
+    session = FakeSession(fail_on=-1)
+    with create_server(session) as server:
+        with pytest.raises(RuntimeError, match='on purpose'):
+            server.predict({'x': np.full(3, -1)}, timeout=5)
+
+
+def test_stop_serves_queued_requests():
+    session = FakeSession(delay=0.01)
+    server = create_server(session, max_batch_size=2, max_queue_delay=0.)
+    server.start()
+    futures = [server.submit({'x': np.full(3, i)}) for i in range(20)]
+    server.stop()
+
+    assert all(future.done() for future in futures)
+    for i, future in enumerate(futures):
+        np.testing.assert_array_equal(future.result()['y'],
+                                      np.full(3, 2 * i))
+    with pytest.raises(RuntimeError):
+        server.submit({'x': np.ones(3)})
+
+
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_restart(n_workers):
+    session = FakeSession()
+    server = create_server(session, n_workers=n_workers)
+    for i in range(3):
+        server.start()
+        np.testing.assert_array_equal(
+            server.predict({'x': np.full(3, i)}, timeout=5)['y'],
+            np.full(3, 2 * i))
+        server.stop()
+
+
+def test_serving_metrics():
+    metrics = ServingMetrics()
+    metrics.record([0.1, 0.2, 0.3])
+    metrics.record([0.4])
+    summary = metrics.summarize()
+    assert summary['n_requests'] == 4
+    assert summary['mean_batch_size'] == 2
+    assert summary['p50_latency'] == pytest.approx(0.25)
+
+
+def test_generate_load():
+    session = FakeSession()
+    with create_server(session, max_batch_size=16) as server:
+        report = generate_load(server, lambda i: {'x': np.full(3, i)},
+                               n_requests=200, concurrency=8)
+    assert report['n_requests'] == 200
+    assert report['p99_latency'] >= report['p50_latency'] > 0
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if not hasattr(tf, 'Session'):
+    pytest.skip('The TensorFlow 1.x API is required.',
+                allow_module_level=True)
+
+from tfutils.tensorboard import (  # noqa:E402
+    variable_summaries, _get_fused_statistics)
+
+
+@pytest.mark.parametrize('mean,stddev', [(0., 1.), (10., 0.01),
+                                         (100., 0.01)])
+def test_fused_statistics(mean, stddev):
+    values = np.random.RandomState(0).normal(mean, stddev, size=[100, 1000])
+    values = values.astype('float32')
+    with tf.Graph().as_default():
+        statistics = _get_fused_statistics(tf.constant(values))
+        with tf.Session() as sess:
+            fused_mean, fused_stddev, max_value, min_value = \
+                sess.run(statistics)
+
+    np.testing.assert_allclose(fused_mean, values.mean(dtype='float64'),
+                               rtol=1e-5)
+    np.testing.assert_allclose(fused_stddev, values.std(dtype='float64'),
+                               rtol=1e-3)
+    assert max_value == values.max()
+    assert min_value == values.min()
+
+
+def test_every_n_steps():
+    with tf.Graph().as_default():
+        global_step = tf.placeholder(shape=[], dtype='int64')
+        variable_summaries(tf.constant([1., 2., 3.]), fused=True,
+                           histogram_sample_size=2, every_n_steps=10,
+                           global_step=global_step)
+        summary_op = tf.summary.merge_all()
+        with tf.Session() as sess:
+            on_step = sess.run(summary_op, {global_step: 20})
+            off_step = sess.run(summary_op, {global_step: 21})
+
+    summary = tf.Summary.FromString(on_step)
+    values = {value.tag.split('/')[-1]: value for value in summary.value}
+    assert values['mean'].simple_value == pytest.approx(2.)
+    assert values['max'].simple_value == pytest.approx(3.)
+    assert not tf.Summary.FromString(off_step).value
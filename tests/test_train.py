@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+if not hasattr(tf, 'Session'):
+    pytest.skip('The TensorFlow 1.x API is required.',
+                allow_module_level=True)
+
+from tfutils.train import (  # noqa:E402
+    clip_by_global_norm, GradientAccumulator, MultiStepTrainer,
+    get_ckpt_name)
+
+
+def create_dense_and_sparse_gvs():
+    """Returns the `(gradient, variable)` pairs of a loss on a dense weight
+    and on a few rows of an embedding, with a gradient `None` for an unused
+    variable."""
+    weight = tf.Variable(np.full([3], 1., 'float32'), name='weight')
+    embedding = tf.Variable(
+        np.arange(15, dtype='float32').reshape([5, 3]), name='embedding')
+    unused = tf.Variable(0., name='unused')
+    ids = tf.placeholder(shape=[None], dtype='int32', name='ids')
+    x = tf.placeholder(shape=[3], dtype='float32', name='x')
+
+    loss = (tf.reduce_sum(weight * x) +
+            tf.reduce_sum(tf.nn.embedding_lookup(embedding, ids) * x))
+    gvs = list(zip(tf.gradients(loss, [weight, embedding, unused]),
+                   [weight, embedding, unused]))
+    return gvs, ids, x
+
+
+def test_clip_by_global_norm():
+    with tf.Graph().as_default():
+        gvs, ids, x = create_dense_and_sparse_gvs()
+        assert isinstance(gvs[1][0], tf.IndexedSlices)
+
+        clipped = clip_by_global_norm(gvs, clip_norm=1.)
+        assert isinstance(clipped[1][0], tf.IndexedSlices)
+        assert clipped[2][0] is None
+
+        grads = [grad for grad, _ in gvs[:2]]
+        expected, _ = tf.clip_by_global_norm(grads, clip_norm=1.)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            feed_dict = {ids: [0, 2, 2], x: [1., 2., 3.]}
+            results = sess.run([tf.convert_to_tensor(grad)
+                                for grad, _ in clipped[:2]], feed_dict)
+            expected = sess.run([tf.convert_to_tensor(grad)
+                                 for grad in expected], feed_dict)
+
+    for result, expected_result in zip(results, expected):
+        np.testing.assert_allclose(result, expected_result, rtol=1e-6)
+
+
+def test_gradient_accumulator():
+    n_micro_batches = 3
+    feeds = [([0], [1., 0., 0.]),
+             ([2, 2], [0., 1., 0.]),
+             ([0], [0., 0., 3.])]
+
+    with tf.Graph().as_default():
+        gvs, ids, x = create_dense_and_sparse_gvs()
+        global_step = tf.train.get_or_create_global_step()
+        accumulator = GradientAccumulator(
+            tf.train.GradientDescentOptimizer(1.), gvs, n_micro_batches,
+            global_step=global_step)
+        (_, weight), (_, embedding) = gvs[:2]
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            weight_0, embedding_0 = sess.run([weight, embedding])
+
+            for run, (feed_ids, feed_x) in enumerate(feeds, 1):
+                sess.run(accumulator.train_op, {ids: feed_ids, x: feed_x})
+                if run < n_micro_batches:
+                    np.testing.assert_array_equal(sess.run(weight), weight_0)
+                    assert sess.run(global_step) == 0
+            weight_1, embedding_1 = sess.run([weight, embedding])
+            assert sess.run(global_step) == 1
+
+            # The accumulators are reset after being applied.
+            for feed_ids, feed_x in feeds:
+                sess.run(accumulator.train_op, {ids: feed_ids, x: feed_x})
+            weight_2, embedding_2 = sess.run([weight, embedding])
+            assert sess.run(global_step) == 2
+
+    # The gradient of the weight is `x`, and the gradient of each looked-up
+    # row of the embedding is also `x`.
+    mean_x = np.mean([feed_x for _, feed_x in feeds], axis=0)
+    np.testing.assert_allclose(weight_1, weight_0 - mean_x)
+    np.testing.assert_allclose(weight_2, weight_1 - mean_x)
+
+    expected_grad = np.zeros_like(embedding_0)
+    for feed_ids, feed_x in feeds:
+        for i in feed_ids:
+            expected_grad[i] += feed_x
+    expected_grad /= n_micro_batches
+    np.testing.assert_allclose(embedding_1, embedding_0 - expected_grad)
+    np.testing.assert_allclose(embedding_2, embedding_1 - expected_grad)
+    # The untouched rows are untouched.
+    np.testing.assert_array_equal(embedding_2[[1, 3, 4]],
+                                  embedding_0[[1, 3, 4]])
+
+
+def test_multi_step_trainer(tmpdir):
+    n_steps_per_run = 4
+
+    def model_fn(x):
+        # The loss is the feature itself, so that its average over the
+        # steps of a run tells which elements the run has consumed.
+        weight = tf.get_variable('weight', shape=[],
+                                 initializer=tf.ones_initializer())
+        loss = x + 0. * weight
+        return loss, {'twice': 2 * x}
+
+    with tf.Graph().as_default():
+        dataset = tf.data.Dataset.range(100).map(
+            lambda x: tf.cast(x, 'float32'))
+        global_step = tf.train.get_or_create_global_step()
+        trainer = MultiStepTrainer(model_fn,
+                                   tf.train.GradientDescentOptimizer(0.1),
+                                   dataset, n_steps_per_run,
+                                   global_step=global_step)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            sess.run(trainer.initializer)
+            results = trainer.train(sess, n_runs=3, save_dir=str(tmpdir),
+                                    save_every_n_runs=1)
+            assert sess.run(global_step) == 3 * n_steps_per_run
+            n_save_ops = len([op for op in sess.graph.get_operations()
+                              if op.type == 'SaveV2'])
+
+    for i, result in enumerate(results):
+        expected_loss = np.mean(np.arange(i * n_steps_per_run,
+                                          (i + 1) * n_steps_per_run))
+        assert result['loss'] == pytest.approx(expected_loss)
+        assert result['twice'] == pytest.approx(2 * expected_loss)
+        assert result['steps_per_sec'] > 0
+    assert n_save_ops == 1
+    assert tmpdir.join(get_ckpt_name(None) + '.index').check()
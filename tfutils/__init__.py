@@ -0,0 +1,34 @@
+"""Utils for TensorFlow.
+
+The submodules are imported lazily, when first accessed as attributes of
+the package, and they import TensorFlow, TensorFlow Probability and IPython
+only when first used. So, the pure-Python utilities, like `pyutils.chunck`
+and `train.smear`, cost no start-up time for the heavy dependencies.
+"""
+
+import importlib
+
+
+_SUBMODULES = (
+    'dataset',
+    'distribution',
+    'graph',
+    'initializer',
+    'monte_carlo_integral',
+    'nn',
+    'pyutils',
+    'serving',
+    'tensorboard',
+    'train',
+)
+
+
+def __getattr__(name):
+  if name in _SUBMODULES:
+    return importlib.import_module('.' + name, __name__)
+  raise AttributeError('module {!r} has no attribute {!r}'
+                       .format(__name__, name))
+
+
+def __dir__():
+  return sorted(list(globals()) + list(_SUBMODULES))
@@ -3,9 +3,11 @@
 Forked from: https://github.com/tensorflow/models/blob/master/research/object_detection/utils/dataset_util.py  # noqa:E501
 """
 
-import tensorflow as tf
+from tfutils.pyutils import LazyModule
 from typing import Dict
 
+tf = LazyModule('tensorflow')
+
 
 def int64_feature(value):
   return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
@@ -28,13 +30,16 @@ def float_list_feature(value):
 
 
 # TODO: Add docstring.
-def get_input_nodes(dataset: tf.data.Dataset) -> Dict[str, str]:
+def get_input_nodes(dataset: 'tf.data.Dataset') -> Dict[str, str]:
   """
   Args:
     dataset: A `tf.data.Dataset` instance.
 
   Returns:
     Dictionary from input feature-name to the corresponding node in the graph.
+
+  Raises:
+    TypeError: If the input features of the dataset is not a dictionary.
   """
   dataset_iter = dataset.make_initializable_iterator()
   features = dataset_iter.get_next()
@@ -42,8 +47,9 @@ def get_input_nodes(dataset: tf.data.Dataset) -> Dict[str, str]:
   if isinstance(features, tuple):  # thus including input, target, etc.
     features = features[0]  # input only, assuming that input is the first.
 
-  if isinstance(features, dict):
-    raise TypeError
+  if not isinstance(features, dict):
+    raise TypeError('The input features of the dataset should be a '
+                    'dictionary, but a {}.'.format(type(features)))
 
   input_nodes = {}
   for input_name, tensor in features.items():
@@ -1,6 +1,8 @@
-import tensorflow as tf
+from tfutils.pyutils import LazyModule
 from tfutils.monte_carlo_integral import monte_carlo_integrate
 
+tf = LazyModule('tensorflow')
+
 
 def get_entropy(distribution, n_samples=32, name='entropy'):
   """Returns the entropy of the distribution `distribution` as a Monte-Carlo
@@ -1,12 +1,9 @@
+import functools
 import collections
 import numpy as np
-import tensorflow as tf
-from IPython.display import display, HTML
-try:
-  import tensorflow_probability as tfp
-  tfd = tfp.distributions
-except ImportError:
-  tfd = tf.contrib.distributions
+from tfutils.pyutils import LazyModule
+
+tf = LazyModule('tensorflow')
 
 
 def is_tensor(x):
@@ -46,6 +43,22 @@ def _get_dependent_variables(tensor):
   return dependent_vars
 
 
+@functools.lru_cache(maxsize=None)
+def get_tfd():
+  """Returns the module of distributions, importing the TensorFlow
+  Probability lazily.
+
+  Returns:
+    Module, `tfp.distributions` if TensorFlow Probability is installed, or
+    `tf.contrib.distributions` otherwise.
+  """
+  try:
+    import tensorflow_probability as tfp
+    return tfp.distributions
+  except ImportError:
+    return tf.contrib.distributions
+
+
 def get_dist_tensors(dist):
   """
   Args:
@@ -72,7 +85,7 @@ def get_dependent_variables(tensor_or_dist):
   if is_tensor(tensor_or_dist):
     return _get_dependent_variables(tensor_or_dist)
 
-  elif isinstance(tensor_or_dist, tfd.Distribution):
+  elif isinstance(tensor_or_dist, get_tfd().Distribution):
     dependent_vars = []
     dist_params = get_dist_tensors(tensor_or_dist)
     for param in dist_params:
@@ -118,6 +131,8 @@ def show_graph(graph_def, max_const_size=32):
   >>> show_graph(gdef)
   >>> # which shows the graph as in the TensorBoard.
   """
+  from IPython.display import display, HTML
+
   if hasattr(graph_def, 'as_graph_def'):
     graph_def = graph_def.as_graph_def()
   strip_def = strip_consts(graph_def, max_const_size=max_const_size)
@@ -142,3 +157,12 @@ def show_graph(graph_def, max_const_size=32):
       </iframe>
   """.format(code.replace('"', '&quot;'))
   display(HTML(iframe))
+
+
+def __getattr__(name):
+  # Keeps the module attribute `tfd` available, while importing the
+  # TensorFlow Probability lazily.
+  if name == 'tfd':
+    return get_tfd()
+  raise AttributeError('module {!r} has no attribute {!r}'
+                       .format(__name__, name))
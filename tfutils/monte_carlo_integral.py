@@ -1,7 +1,9 @@
 import numpy as np
-import tensorflow as tf
+from tfutils.pyutils import LazyModule
 from numbers import Real
 
+tf = LazyModule('tensorflow')
+
 
 EPSILON = 1e-8
 
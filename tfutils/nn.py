@@ -1,26 +1,177 @@
-import tensorflow as tf
+import numpy as np
+from tfutils.pyutils import LazyModule
 
+tf = LazyModule('tensorflow')
 
-def residual_block_wrapper(inputs, outputs):
-  with tf.variable_scope('residual_block'):
-    if inputs.shape == outputs.shape:
-      return outputs + inputs
 
-    def get_shape(x):
-      return x.get_shape().as_list()
+def residual_block_wrapper(inputs, outputs, projection='auto', name=None):
+  """Returns `outputs + shortcut(inputs)`, wherein the shortcut maps the
+  `inputs` to the shape of `outputs` by the cheapest correct projection.
 
+  The shapes are compared axis by axis, with the first axis as the batch
+  axis and the last as the channel axis. If `projection` is "auto", then
+  the shortcut is
+
+    1. identity, if the shapes are the same;
+    2. otherwise, strided subsampling of the axes in between that shrink,
+       followed by zero-padding of the channels if they increase, or a
+       learned projection of the channels if they decrease. The stride of
+       each shrinking axis is that of a convolution with either the "same"
+       padding, i.e. `ceil(isize / stride) == osize`, or the "valid"
+       padding with the kernel size not greater than the stride, i.e.
+       `floor(isize / stride) == osize`.
+
+  If `projection` is "learned", then the shortcut is always a learned
+  projection over the mismatched trailing axes, over the last axis at
+  least, as a batched `tf.tensordot()`. Beware that its weights grow as
+  the product of the sizes of these axes.
+
+  The weights of the learned projection are created by `GlorotInitializer`
+  within a variable scope. If `name` is `None`, each call has its own
+  unique scope, like "residual_block", "residual_block_1", etc., so that
+  stacked blocks never share weights. Otherwise, the scope is `name`, and
+  the weights are reused in the later calls with the same `name`.
+
+  Examples:
+  >>> inputs = tf.placeholder(shape=[None, 32, 32, 16], dtype='float32')
+  >>> hidden = tf.layers.conv2d(inputs, 32, 3, strides=2, padding='same')
+  >>> outputs = residual_block_wrapper(inputs, hidden)
+  >>> # `inputs` is subsampled to `[None, 16, 16, 16]`, and then
+  >>> # zero-padded to `[None, 16, 16, 32]`.
+
+  Args:
+    inputs: Tensor.
+    outputs: Tensor.
+    projection: String, either "auto" or "learned".
+    name: String or `None`.
+
+  Returns:
+    Tensor with the same shape and dtype as `outputs`.
+
+  Raises:
+    ValueError: If `projection` is neither "auto" nor "learned". If
+      `projection` is "auto" and the axes other than the channel axis
+      cannot be mapped by strided subsampling. If the mismatched axes of
+      `inputs` and `outputs` that are to be projected are not static.
+  """
+  if projection not in ('auto', 'learned'):
+    raise ValueError('Arg `projection` should be either "auto" or '
+                     '"learned", but {}.'.format(projection))
+
+  reuse = None if name is None else tf.AUTO_REUSE
+  with tf.variable_scope(name, default_name='residual_block', reuse=reuse):
     ishape, oshape = [get_shape(_) for _ in (inputs, outputs)]
-    irank, orank = [len(_) for _ in (ishape, oshape)]
-
-    for i in range(min(irank, orank)):
-      if ishape[i] != oshape[i]:
-        max_batch_axis = i - 1
-        break
-    else:
-      max_batch_axis = i
-
-    # TODO: Determine the shape of weights.
-    weight_shape = ...
-    weights = tf.get_variable(
-        name='weights', shape=weight_shape, dtype=inputs.dtype)
-    return outputs + tf.matmul(weights, inputs)
+
+    if projection == 'auto':
+      return outputs + _get_cheap_shortcut(inputs, ishape, oshape)
+    return outputs + _learned_projection(inputs, ishape, oshape)
+
+
+def get_shape(x):
+  """Returns the static shape of the tensor `x`, as a list of integers or
+  `None`s."""
+  return x.get_shape().as_list()
+
+
+def _get_cheap_shortcut(inputs, ishape, oshape):
+  """Auxillary function of `residual_block_wrapper()`. Returns the shortcut
+  by identity, strided subsampling and zero-padding, or by strided
+  subsampling followed by the learned projection of the channels.
+
+  Raises:
+    ValueError: If the axes other than the channel axis cannot be mapped
+      by strided subsampling.
+  """
+  if ishape == oshape:
+    return inputs
+
+  rank = len(ishape)
+  if rank != len(oshape) or rank < 2 or ishape[0] != oshape[0]:
+    raise ValueError(
+        'No cheap shortcut from shape {} to {}, since the ranks or the '
+        'batch axes differ. Use `projection="learned"` instead.'
+        .format(ishape, oshape))
+
+  # Strided subsampling of the axes in between.
+  slices = [slice(None)]
+  for isize, osize in zip(ishape[1:-1], oshape[1:-1]):
+    if isize == osize:
+      slices.append(slice(None))
+      continue
+    stride = _get_subsampling_stride(isize, osize)
+    if stride is None:
+      raise ValueError(
+          'No cheap shortcut from shape {} to {}, since no stride maps {} '
+          'to {}. Use `projection="learned"` instead.'
+          .format(ishape, oshape, isize, osize))
+    # Takes the `osize` positions that the strided kernel starts at.
+    slices.append(slice(None, (osize - 1) * stride + 1, stride))
+  slices.append(slice(None))
+
+  shortcut = inputs
+  if ishape[1:-1] != oshape[1:-1]:
+    shortcut = inputs[tuple(slices)]
+
+  # Channels
+  ichannels, ochannels = ishape[-1], oshape[-1]
+  if ichannels == ochannels:
+    return shortcut
+  if ichannels is None or ochannels is None:
+    raise ValueError('The channels should be static, but being {} for '
+                     'inputs and {} for outputs.'
+                     .format(ichannels, ochannels))
+  if ichannels < ochannels:
+    paddings = [[0, 0]] * (rank - 1) + [[0, ochannels - ichannels]]
+    return tf.pad(shortcut, paddings)
+  return _learned_projection(shortcut,
+                             ishape[:1] + oshape[1:-1] + ishape[-1:],
+                             oshape)
+
+
+def _get_subsampling_stride(isize, osize):
+  """Auxillary function of `_get_cheap_shortcut()`. Returns the stride that
+  shrinks the axis of size `isize` to `osize`, as a convolution with the
+  "same" padding, or else with the "valid" padding, or `None` if there is
+  no such stride."""
+  if isize is None or osize is None or not (0 < osize < isize):
+    return None
+  same_stride = -(-isize // osize)  # ceiling.
+  if -(-isize // same_stride) == osize:
+    return same_stride
+  valid_stride = isize // osize  # floor.
+  if isize // valid_stride == osize:
+    return valid_stride
+  return None
+
+
+def _learned_projection(inputs, ishape, oshape):
+  """Auxillary function of `residual_block_wrapper()`. Returns the learned
+  projection of `inputs`, over the trailing axes from the first mismatched
+  axis on, or over the last axis if none is mismatched.
+  """
+  # Find the first mismatched axis
+  min_rank = min(len(ishape), len(oshape))
+  for axis in range(min_rank):
+    if ishape[axis] != oshape[axis]:
+      break
+  else:
+    axis = min_rank - 1 if len(ishape) == len(oshape) else min_rank
+
+  itail, otail = ishape[axis:], oshape[axis:]
+  if None in itail or None in otail:
+    raise ValueError('The mismatched trailing axes should be static, but '
+                     'being {} for inputs and {} for outputs.'
+                     .format(itail, otail))
+
+  # Imported here, since `tfutils.initializer` imports TensorFlow eagerly.
+  from tfutils.initializer import GlorotInitializer
+
+  # Weights are created as a matrix, so that the fan-in and fan-out of the
+  # initializer are the sizes of the trailing axes.
+  weights = tf.get_variable(
+      name='weights',
+      shape=[int(np.prod(itail)), int(np.prod(otail))],
+      dtype=inputs.dtype.base_dtype,
+      initializer=GlorotInitializer())
+  weights = tf.reshape(weights, itail + otail)
+  return tf.tensordot(inputs, weights, axes=len(itail))
@@ -1,8 +1,10 @@
 import os
 import time
+import types
 import inspect
 import functools
 import builtins
+import importlib
 from typing import Iterable, List
 
 
@@ -143,6 +145,28 @@ class Timer(object):
                 print('=> Costs {} secs.'.format(self._interval))
 
 
+class LazyModule(types.ModuleType):
+    """Proxy of the module with name `name`, which is imported only when
+    any of its attributes is accessed for the first time. Thereafter, the
+    attributes are looked up as fast as those of the module itself.
+
+    This keeps the heavy dependencies, like TensorFlow, away from the
+    start-up of the processes that do not use them.
+
+    Examples:
+    >>> tf = LazyModule('tensorflow')  # TensorFlow is not imported yet.
+    >>> x = tf.constant(1.0)  # TensorFlow is imported now.
+
+    Args:
+        name: String.
+    """
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
 # Auxillary function for vanishing the `NameError` caused by
 # employing `line_profiler` module in simple `python` run.
 #
@@ -0,0 +1,385 @@
+"""In-process serving with dynamic batching.
+
+The concurrent requests are coalesced into batches, which run through one
+shared session on a pool of workers, so that the overhead of
+`session.run()` is paid per batch instead of per request.
+"""
+
+import time
+import queue
+import asyncio
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+
+
+_STOP = object()  # sentinel for stopping the batching thread.
+
+_Request = collections.namedtuple(
+    '_Request', ['features', 'future', 'enqueued_at'])
+
+
+class BatchingServer(object):
+  """Serves the model in the session `session` by batching the concurrent
+  requests dynamically.
+
+  Each request is a dictionary from input feature-name to the array of a
+  single example, i.e. without the batch axis. A batch is dispatched once it
+  has `max_batch_size` requests, or once its first request has been queued
+  for `max_queue_delay` seconds. While all the workers are busy, requests
+  keep queuing, so that batches grow with load.
+
+  Examples:
+  >>> input_nodes = get_input_nodes(dataset)
+  >>> ...  # build the model on the input nodes.
+  >>> restore_variables(sess, ALL_VARS, save_dir)
+  >>> with BatchingServer(sess, input_nodes, {'y': 'model/output:0'},
+  >>>                     max_batch_size=64, max_queue_delay=2e-3) as server:
+  >>>   outputs = server.predict({'x': x})  # thread-based front-end.
+  >>>   outputs = await server.predict_async({'x': x})  # asyncio front-end.
+  >>>   print(server.get_metrics())
+
+  Args:
+    session: An instance of `tf.Session`, shared by all the workers.
+    input_nodes: Dictionary from input feature-name to the name of the
+      corresponding node in the graph, as returned by
+      `tfutils.dataset.get_input_nodes()`.
+    output_nodes: Dictionary from output name to the name of the
+      corresponding node in the graph, whose first axis is the batch axis.
+    max_batch_size: Positive integer.
+    max_queue_delay: Non-negative float, in seconds.
+    n_workers: Positive integer, as the number of batches that run
+      concurrently.
+    input_shapes: Dictionary from input feature-name to the shape of a
+      single example, as a list of integers or `None`s for the unknown
+      dimensions, or `None`. If `None`, the shapes are read from the graph
+      of `session`. A request that does not fit them fails alone.
+  """
+
+  def __init__(self,
+               session,
+               input_nodes,
+               output_nodes,
+               max_batch_size=32,
+               max_queue_delay=1e-3,
+               n_workers=1,
+               input_shapes=None):
+    assert max_batch_size > 0 and max_queue_delay >= 0 and n_workers > 0
+    self._session = session
+    self._input_nodes = dict(input_nodes)
+    if input_shapes is None:
+      input_shapes = {
+          name: _get_example_shape(session.graph, node)
+          for name, node in self._input_nodes.items()}
+    self._input_shapes = dict(input_shapes)
+    self._output_nodes = dict(output_nodes)
+    self._max_batch_size = max_batch_size
+    self._max_queue_delay = max_queue_delay
+    self._n_workers = n_workers
+
+    self._queue = queue.Queue()
+    # Guards `self._running`, so that no request is queued after `_STOP`.
+    self._lock = threading.Lock()
+    self._running = False
+    self._worker_slots = threading.Semaphore(n_workers)
+    self._executor = None
+    self._batching_thread = None
+    self._metrics = ServingMetrics()
+
+  def start(self):
+    """Starts the batching thread and the workers."""
+    with self._lock:
+      if self._batching_thread is not None:
+        raise RuntimeError('The server has been started.')
+      self._executor = concurrent.futures.ThreadPoolExecutor(
+          self._n_workers)
+      self._batching_thread = threading.Thread(target=self._batch_forever,
+                                               daemon=True)
+      self._batching_thread.start()
+      self._metrics.reset()
+      self._running = True
+
+  def stop(self):
+    """Serves the requests that have been submitted, and then stops."""
+    with self._lock:
+      if not self._running:
+        return
+      self._running = False
+      self._queue.put(_STOP)
+    self._batching_thread.join()
+    self._executor.shutdown(wait=True)
+    self._batching_thread, self._executor = None, None
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, *args):
+    self.stop()
+
+  def submit(self, features):
+    """
+    Args:
+      features: Dictionary from input feature-name to array-like, as a
+        single example.
+
+    Returns:
+      An instance of `concurrent.futures.Future`, whose result is the
+      dictionary from output name to the array of the example. If the
+      `features` miss any input feature or do not fit its shape, then the
+      future fails with `KeyError` or `ValueError`.
+
+    Raises:
+      RuntimeError: If the server is not running.
+    """
+    future = concurrent.futures.Future()
+    try:
+      features = self._check_features(features)
+    except (KeyError, ValueError, TypeError) as e:
+      future.set_exception(e)
+      return future
+    with self._lock:
+      if not self._running:
+        raise RuntimeError('The server is not running.')
+      self._queue.put(_Request(features, future, time.monotonic()))
+    return future
+
+  def predict(self, features, timeout=None):
+    """Blocking version of `self.submit()`, for the thread-based callers.
+
+    Args:
+      features: Dictionary from input feature-name to array-like.
+      timeout: Positive float or `None`, in seconds.
+
+    Returns:
+      Dictionary from output name to array.
+    """
+    return self.submit(features).result(timeout)
+
+  async def predict_async(self, features):
+    """Awaitable version of `self.submit()`, for the asyncio callers.
+
+    Args:
+      features: Dictionary from input feature-name to array-like.
+
+    Returns:
+      Dictionary from output name to array.
+    """
+    return await asyncio.wrap_future(self.submit(features))
+
+  def get_metrics(self):
+    """Returns the metrics since the server started, as in
+    `ServingMetrics.summarize()`."""
+    return self._metrics.summarize()
+
+  def _check_features(self, features):
+    """Returns the dictionary from input feature-name to array, keeping
+    the input features only.
+
+    Raises:
+      KeyError: If any input feature is missing.
+      ValueError: If any input feature does not fit its shape.
+    """
+    checked = {}
+    for name in self._input_nodes:
+      if name not in features:
+        raise KeyError('The input feature {!r} is missing.'.format(name))
+      array = np.asarray(features[name])
+      expected_shape = self._input_shapes.get(name)
+      if expected_shape is not None and not _fits(array.shape,
+                                                  expected_shape):
+        raise ValueError('The input feature {!r} should have shape {}, but '
+                         '{}.'.format(name, expected_shape, array.shape))
+      checked[name] = array
+    return checked
+
+  def _batch_forever(self):
+    stopping = False
+    while not stopping:
+      self._worker_slots.acquire()  # waits for a free worker.
+
+      request = self._queue.get()
+      if request is _STOP:
+        self._worker_slots.release()  # so that a restart has all slots.
+        break
+      batch = [request]
+      deadline = request.enqueued_at + self._max_queue_delay
+
+      while len(batch) < self._max_batch_size:
+        timeout = deadline - time.monotonic()
+        try:
+          if timeout > 0:
+            request = self._queue.get(timeout=timeout)
+          else:  # takes the queued requests only.
+            request = self._queue.get_nowait()
+        except queue.Empty:
+          break
+        if request is _STOP:
+          stopping = True
+          break
+        batch.append(request)
+
+      self._executor.submit(self._run_batch, batch)
+
+  def _run_batch(self, batch):
+    try:
+      # Requests whose features differ in the unknown dimensions cannot be
+      # stacked together, thus run in separate sub-batches.
+      sub_batches = collections.OrderedDict()
+      for request in batch:
+        try:
+          signature = tuple(request.features[name].shape
+                            for name in self._input_nodes)
+        except Exception as e:
+          request.future.set_exception(e)
+          continue
+        sub_batches.setdefault(signature, []).append(request)
+
+      for sub_batch in sub_batches.values():
+        self._run_sub_batch(sub_batch)
+
+    finally:
+      self._worker_slots.release()
+
+  def _run_sub_batch(self, batch):
+    try:
+      feed_dict = {
+          node: np.stack([request.features[name] for request in batch])
+          for name, node in self._input_nodes.items()}
+      outputs = self._session.run(self._output_nodes, feed_dict=feed_dict)
+      for i, request in enumerate(batch):
+        request.future.set_result(
+            {name: value[i] for name, value in outputs.items()})
+    except Exception as e:
+      for request in batch:
+        if not request.future.done():
+          request.future.set_exception(e)
+    finally:
+      done_at = time.monotonic()
+      self._metrics.record([done_at - request.enqueued_at
+                            for request in batch])
+
+
+def _get_example_shape(graph, node):
+  """Auxillary function of `BatchingServer`. Returns the static shape of
+  the node `node` in `graph` without the batch axis, or `None` if the rank
+  is unknown."""
+  shape = graph.get_tensor_by_name(node).get_shape()
+  if shape.ndims is None:
+    return None
+  return shape.as_list()[1:]
+
+
+def _fits(shape, expected_shape):
+  """Auxillary function of `BatchingServer`. Returns if the `shape` fits
+  the `expected_shape`, wherein `None` fits any dimension."""
+  if len(shape) != len(expected_shape):
+    return False
+  return all(expected is None or size == expected
+             for size, expected in zip(shape, expected_shape))
+
+
+class ServingMetrics(object):
+  """Thread-safe recorder of the latencies of the requests, and the sizes
+  of the batches.
+
+  Args:
+    max_records: Positive integer, as the number of the latest latencies
+      kept for computing the percentiles.
+  """
+
+  def __init__(self, max_records=100000):
+    self._lock = threading.Lock()
+    self._max_records = max_records
+    self.reset()
+
+  def reset(self):
+    with self._lock:
+      self._latencies = collections.deque(maxlen=self._max_records)
+      self._n_requests = 0
+      self._n_batches = 0
+      self._start = time.monotonic()
+
+  def record(self, latencies):
+    """Records the latencies of the requests of one batch.
+
+    Args:
+      latencies: List of floats, in seconds.
+    """
+    with self._lock:
+      self._latencies.extend(latencies)
+      self._n_requests += len(latencies)
+      self._n_batches += 1
+
+  def summarize(self):
+    """
+    Returns:
+      Dictionary with keys "n_requests", "throughput" (requests per
+      second), "p50_latency", "p99_latency" (in seconds) and
+      "mean_batch_size".
+    """
+    with self._lock:
+      latencies = list(self._latencies)
+      n_requests, n_batches = self._n_requests, self._n_batches
+      duration = time.monotonic() - self._start
+
+    summary = {'n_requests': n_requests,
+               'throughput': n_requests / duration,
+               'p50_latency': None,
+               'p99_latency': None,
+               'mean_batch_size': None}
+    if latencies:
+      summary['p50_latency'] = float(np.percentile(latencies, 50))
+      summary['p99_latency'] = float(np.percentile(latencies, 99))
+      summary['mean_batch_size'] = n_requests / n_batches
+    return summary
+
+
+def generate_load(server, make_features, n_requests, concurrency):
+  """Local load generator for testing the `server`. Each of the
+  `concurrency` client threads sends its requests one after another,
+  waiting for the response before sending the next.
+
+  Examples:
+  >>> with BatchingServer(sess, input_nodes, output_nodes) as server:
+  >>>   report = generate_load(
+  >>>       server, lambda i: {'x': np.random.randn(784)},
+  >>>       n_requests=10000, concurrency=64)
+
+  Args:
+    server: A `BatchingServer` instance, which has been started.
+    make_features: Callable that maps the index of the request to the
+      features of the request.
+    n_requests: Positive integer.
+    concurrency: Positive integer.
+
+  Returns:
+    Dictionary as in `ServingMetrics.summarize()`, but measured on the
+    client side.
+  """
+  metrics = ServingMetrics()
+  request_ids = iter(range(n_requests))
+  request_ids_lock = threading.Lock()
+
+  def send_requests():
+    while True:
+      with request_ids_lock:
+        request_id = next(request_ids, None)
+      if request_id is None:
+        return
+      features = make_features(request_id)
+      start = time.monotonic()
+      server.predict(features)
+      metrics.record([time.monotonic() - start])
+
+  clients = [threading.Thread(target=send_requests)
+             for _ in range(concurrency)]
+  for client in clients:
+    client.start()
+  for client in clients:
+    client.join()
+
+  summary = metrics.summarize()
+  summary.pop('mean_batch_size')  # not observable by the clients.
+  return summary
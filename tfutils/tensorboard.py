@@ -1,28 +1,157 @@
-import tensorflow as tf
+from tfutils.pyutils import LazyModule
 
+tf = LazyModule('tensorflow')
 
-def variable_summaries(var, name='summaries'):
+
+def variable_summaries(var,
+                       name='summaries',
+                       fused=False,
+                       histogram_sample_size=None,
+                       every_n_steps=None,
+                       global_step=None):
   """Attaches a lot of summaries to a Tensor `var` (for TensorBoard
   visualization).
 
   Forked from: https://www.tensorflow.org/guide/summaries_and_tensorboard
 
+  By default, this is the original version, wherein the histogram and the
+  mean, stddev, max and min reductions are separate ops, all evaluated each
+  time the summaries are. For models with many variables, set `fused` as
+  `True`, `histogram_sample_size` and `every_n_steps`, so that the cost of
+  summaries stays constant as the model grows.
+
+  Examples:
+  >>> for var in tf.trainable_variables():
+  >>>   variable_summaries(var, name=var.op.name, fused=True,
+  >>>                      histogram_sample_size=1024,
+  >>>                      every_n_steps=100)
+  >>> summary_op = tf.summary.merge_all()
+
   Args:
     var: Tensor.
     name: String.
+    fused: Boolean. If `True`, the variance is reduced from the fused
+      `tf.squared_difference()` kernel over the flattened `var`, which saves
+      the intermediate tensor `var - mean` of the original version. The
+      statistics are still the two-pass ones, for numerical stability.
+    histogram_sample_size: Positive integer or `None`. If not `None`, the
+      histogram is made on a random subsample (with replacement) of this
+      size of the components of `var`, instead of on the whole of `var`.
+    every_n_steps: Positive integer or `None`. If not `None`, the summaries
+      are computed only when `global_step` is a multiple of it. In other
+      steps, evaluating the summaries costs nothing and yields an empty
+      summary.
+    global_step: Integer tensor or `None`. If `None`, employs the one given
+      by `tf.train.get_or_create_global_step()`. Used only when
+      `every_n_steps` is not `None`.
   """
   with tf.name_scope(name):
-    tf.summary.histogram('histogram', var)
-
-    shape = var.get_shape().as_list()
-    if not shape:  # scalar.
-      tf.summary.scalar('mean', var)
-
-    else:  # multi-component tensor
-      mean = tf.reduce_mean(var)
-      tf.summary.scalar('mean', mean)
-      with tf.name_scope('stddev'):
-        stddev = tf.sqrt(tf.reduce_mean(tf.square(var - mean)))
-      tf.summary.scalar('stddev', stddev)
-      tf.summary.scalar('max', tf.reduce_max(var))
-      tf.summary.scalar('min', tf.reduce_min(var))
+
+    if every_n_steps is None:
+      _add_summaries(var, fused, histogram_sample_size)
+      return
+
+    if global_step is None:
+      global_step = tf.train.get_or_create_global_step()
+    global_step = tf.cast(global_step, tf.int64)
+    should_summarize = tf.equal(global_step % every_n_steps, 0)
+
+    def summarize():
+      summaries = _add_summaries(var, fused, histogram_sample_size,
+                                 collections=[])
+      return tf.summary.merge(summaries, collections=[])
+
+    def skip():
+      return tf.constant('')  # an empty serialized `Summary`.
+
+    summary = tf.cond(should_summarize, summarize, skip)
+    tf.add_to_collection(tf.GraphKeys.SUMMARIES, summary)
+
+
+def _add_summaries(var, fused, histogram_sample_size, collections=None):
+  """Auxillary function of `variable_summaries()`.
+
+  Args:
+    var: Tensor.
+    fused: Boolean.
+    histogram_sample_size: Positive integer or `None`.
+    collections: List of strings or `None`, as in `tf.summary.scalar()`.
+
+  Returns:
+    List of summary tensors.
+  """
+  summaries = []
+
+  if histogram_sample_size is None:
+    histogram_values = var
+  else:
+    histogram_values = _subsample(var, histogram_sample_size)
+  summaries.append(tf.summary.histogram('histogram', histogram_values,
+                                        collections=collections))
+
+  shape = var.get_shape().as_list()
+  if not shape:  # scalar.
+    summaries.append(tf.summary.scalar('mean', var, collections=collections))
+    return summaries
+
+  # multi-component tensor
+  if fused:
+    mean, stddev, max_value, min_value = _get_fused_statistics(var)
+  else:
+    mean = tf.reduce_mean(var)
+    with tf.name_scope('stddev'):
+      stddev = tf.sqrt(tf.reduce_mean(tf.square(var - mean)))
+    max_value, min_value = tf.reduce_max(var), tf.reduce_min(var)
+  summaries += [
+      tf.summary.scalar('mean', mean, collections=collections),
+      tf.summary.scalar('stddev', stddev, collections=collections),
+      tf.summary.scalar('max', max_value, collections=collections),
+      tf.summary.scalar('min', min_value, collections=collections),
+  ]
+  return summaries
+
+
+def _get_fused_statistics(var):
+  """Returns the mean, stddev, max and min of the components of `var`.
+
+  The variance is the two-pass one, i.e. the mean of the squared deviations
+  from the mean, which, unlike `E[x^2] - E[x]^2`, does not cancel
+  catastrophically when the mean is large comparing to the stddev.
+
+  Args:
+    var: Tensor with at least one component.
+
+  Returns:
+    Tuple of four scalar tensors.
+  """
+  with tf.name_scope('fused_statistics'):
+    flat_var = tf.reshape(var, [-1])
+    mean = tf.reduce_mean(flat_var)
+    with tf.name_scope('stddev'):
+      stddev = tf.sqrt(
+          tf.reduce_mean(tf.squared_difference(flat_var, mean)))
+    return mean, stddev, tf.reduce_max(flat_var), tf.reduce_min(flat_var)
+
+
+def _subsample(var, sample_size):
+  """Returns `sample_size` components of `var` randomly sampled with
+  replacement, or all the components of `var` if there are not more than
+  `sample_size` of them.
+
+  Args:
+    var: Tensor.
+    sample_size: Positive integer.
+
+  Returns:
+    Tensor with shape `[n]` where `n <= sample_size`.
+  """
+  with tf.name_scope('subsample'):
+    flat_var = tf.reshape(var, [-1])
+    n_components = tf.size(flat_var, out_type=tf.int64)
+
+    def sample():
+      indices = tf.random_uniform([sample_size], maxval=n_components,
+                                  dtype=tf.int64)
+      return tf.gather(flat_var, indices)
+
+    return tf.cond(n_components > sample_size, sample, lambda: flat_var)
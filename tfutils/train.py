@@ -1,6 +1,12 @@
 import os
+import json
+import time
+import hashlib
+import platform
 import numpy as np
-import tensorflow as tf
+from tfutils.pyutils import LazyModule
+
+tf = LazyModule('tensorflow')
 
 
 ALL_VARS = None
@@ -27,6 +33,204 @@ def clip(gradient, min_clip_value=-1e+0, max_clip_value=1e+0):
   return tf.clip_by_value(gradient, min_clip_value, max_clip_value)
 
 
+def clip_by_global_norm(grads_and_vars, clip_norm,
+                        name='clip_by_global_norm'):
+  """Rescales all the gradients together, so that their global norm is not
+  greater than `clip_norm`. The global norm is computed in one reduction
+  over all the gradients. Sparse gradients, i.e. `tf.IndexedSlices`, keep
+  being sparse.
+
+  Examples:
+  >>> loss = ...
+  >>> optimizer = tf.train.AdamOptimizer()
+  >>> gvs = optimizer.compute_gradients(loss)
+  >>> gvs = clip_by_global_norm(gvs, clip_norm=5.0)
+  >>> train_op = optimizer.apply_gradients(gvs)
+
+  Args:
+    grads_and_vars: List of `(gradient, variable)` pairs, as returned by
+      `tf.train.Optimizer.compute_gradients()`. The gradient can be `None`.
+    clip_norm: Positive float.
+    name: String.
+
+  Returns:
+    List of `(gradient, variable)` pairs.
+  """
+  assert clip_norm > 0
+  with tf.name_scope(name):
+    squared_norms = [tf.reduce_sum(tf.square(_get_values(grad)))
+                     for grad, _ in grads_and_vars if grad is not None]
+    if not squared_norms:
+      return list(grads_and_vars)
+    global_norm = tf.sqrt(tf.add_n(squared_norms))
+    scale = clip_norm / tf.maximum(global_norm, clip_norm)
+
+    clipped = []
+    for grad, var in grads_and_vars:
+      if grad is None:
+        clipped.append((grad, var))
+      elif isinstance(grad, tf.IndexedSlices):
+        values = grad.values * tf.cast(scale, grad.values.dtype)
+        clipped.append(
+            (tf.IndexedSlices(values, grad.indices, grad.dense_shape), var))
+      else:
+        clipped.append((grad * tf.cast(scale, grad.dtype), var))
+    return clipped
+
+
+def _get_values(gradient):
+  """Auxillary function. Returns the values of the gradient `gradient`,
+  without densifying it if sparse.
+
+  Args:
+    gradient: Tensor or `tf.IndexedSlices`.
+
+  Returns:
+    Tensor.
+  """
+  if isinstance(gradient, tf.IndexedSlices):
+    return gradient.values
+  return gradient
+
+
+class GradientAccumulator(object):
+  """Accumulates the gradients over `n_micro_batches` micro-batches within
+  the graph, and applies their average to the variables once every
+  `n_micro_batches` runs of `self.train_op`. This makes the effective batch
+  size `n_micro_batches` times the micro-batch size, without holding the
+  large batch in memory.
+
+  The accumulators are non-trainable variables with the same shapes as
+  the variables. Sparse gradients, i.e. `tf.IndexedSlices`, are accumulated
+  by `tf.scatter_add()`, and the touched rows are marked, so that only the
+  average over these rows is applied, as a `tf.IndexedSlices`. Thus, for
+  an embedding, the untouched rows of the variable and of the slots of the
+  optimizer are neither read nor updated.
+
+  Examples:
+  >>> loss = ...  # on a micro-batch.
+  >>> optimizer = tf.train.AdamOptimizer()
+  >>> gvs = optimizer.compute_gradients(loss)
+  >>> gvs = clip_by_global_norm(gvs, clip_norm=5.0)
+  >>> accumulator = GradientAccumulator(optimizer, gvs, n_micro_batches=8)
+  >>> with tf.Session() as sess:
+  >>>   sess.run(tf.global_variables_initializer())
+  >>>   for step in range(n_steps):
+  >>>     sess.run(accumulator.train_op)
+
+  Args:
+    optimizer: A `tf.train.Optimizer` instance.
+    grads_and_vars: List of `(gradient, variable)` pairs, as returned by
+      `tf.train.Optimizer.compute_gradients()`. The gradient can be `None`.
+    n_micro_batches: Positive integer.
+    global_step: Integer variable or `None`, as in
+      `tf.train.Optimizer.apply_gradients()`. It increments only when the
+      gradients are applied.
+    name: String.
+  """
+
+  def __init__(self,
+               optimizer,
+               grads_and_vars,
+               n_micro_batches,
+               global_step=None,
+               name='gradient_accumulator'):
+    assert n_micro_batches > 0
+    self._optimizer = optimizer
+    self._n_micro_batches = n_micro_batches
+    self._global_step = global_step
+
+    with tf.variable_scope(name):
+      self._grads_and_vars = [(grad, var) for grad, var in grads_and_vars
+                              if grad is not None]
+      self._accumulators = [
+          tf.Variable(tf.zeros(var.get_shape(), var.dtype.base_dtype),
+                      trainable=False,
+                      name=var.op.name)
+          for _, var in self._grads_and_vars]
+      # Marks of the touched rows, for sparse gradients only.
+      self._touched_rows = [
+          tf.Variable(tf.zeros(var.get_shape()[:1], tf.int32),
+                      trainable=False,
+                      name=var.op.name + '_touched_rows')
+          if isinstance(grad, tf.IndexedSlices) else None
+          for grad, var in self._grads_and_vars]
+      self._counter = tf.Variable(0, trainable=False, dtype=tf.int64,
+                                  name='counter')
+
+      with tf.name_scope('accumulate'):
+        accumulate_ops = []
+        for accumulator, touched_rows, (grad, _) in zip(
+            self._accumulators, self._touched_rows, self._grads_and_vars):
+          accumulate_ops += self._accumulate(accumulator, touched_rows, grad)
+        with tf.control_dependencies(accumulate_ops):
+          self._accumulate_op = tf.assign_add(self._counter, 1)
+
+      # The apply-and-reset subgraph is built only once, within the
+      # `tf.cond`. The slots of the optimizer are still created out of the
+      # control-flow, since `apply_gradients()` creates them within
+      # `tf.init_scope()`.
+      with tf.name_scope('train'):
+        should_apply = tf.equal(self._accumulate_op % n_micro_batches, 0)
+        self._train_op = tf.cond(should_apply,
+                                 self._apply_and_reset,
+                                 tf.no_op)
+
+  @property
+  def accumulate_op(self):
+    """Op that adds the gradients of the current micro-batch to the
+    accumulators."""
+    return self._accumulate_op
+
+  @property
+  def train_op(self):
+    """Op that runs `self.accumulate_op`, and then, once every
+    `n_micro_batches` runs, applies the average of the accumulated
+    gradients and resets the accumulators."""
+    return self._train_op
+
+  def _accumulate(self, accumulator, touched_rows, gradient):
+    if touched_rows is None:
+      return [tf.assign_add(accumulator, gradient)]
+    marks = tf.ones_like(gradient.indices, dtype=tf.int32)
+    return [tf.scatter_add(accumulator, gradient.indices, gradient.values),
+            tf.scatter_update(touched_rows, gradient.indices, marks)]
+
+  def _apply_and_reset(self):
+    averaged_gvs = []
+    sparse_resets = []  # `(accumulator, touched_rows, rows)` triplets.
+    for accumulator, touched_rows, (_, var) in zip(
+        self._accumulators, self._touched_rows, self._grads_and_vars):
+      if touched_rows is None:
+        averaged = accumulator.read_value() / self._n_micro_batches
+      else:
+        # Unique by construction, as the non-zero marks.
+        rows = tf.where(tf.not_equal(touched_rows, 0))[:, 0]
+        values = tf.gather(accumulator, rows) / self._n_micro_batches
+        averaged = tf.IndexedSlices(values, rows,
+                                    tf.shape(var, out_type=tf.int64))
+        sparse_resets.append((accumulator, touched_rows, rows))
+      averaged_gvs.append((averaged, var))
+    apply_op = self._optimizer.apply_gradients(
+        averaged_gvs, global_step=self._global_step)
+
+    with tf.control_dependencies([apply_op]):
+      reset_ops = [tf.assign(accumulator, tf.zeros_like(accumulator))
+                   for accumulator, touched_rows
+                   in zip(self._accumulators, self._touched_rows)
+                   if touched_rows is None]
+      for accumulator, touched_rows, rows in sparse_resets:
+        row_shape = tf.shape(accumulator)[1:]
+        zeros = tf.zeros(tf.concat([tf.shape(rows), row_shape], axis=0),
+                         accumulator.dtype.base_dtype)
+        reset_ops += [
+            tf.scatter_update(accumulator, rows, zeros),
+            tf.scatter_update(touched_rows, rows,
+                              tf.zeros_like(rows, dtype=tf.int32))]
+      reset_ops.append(tf.assign(self._counter, 0))
+    return tf.group(*reset_ops)
+
+
 def get_ckpt_name(scope):
   """Auxillary funtion.
 
@@ -75,6 +279,164 @@ def restore_variables(session, scope, save_dir):
   saver.restore(session, ckpt_path)
 
 
+class MultiStepTrainer(object):
+  """Runs `n_steps_per_run` optimization steps within one `session.run()`,
+  by an in-graph while-loop that pulls the features from the iterator of
+  `dataset`. This saves the Python-runtime round-trip per step, which
+  dominates the step time of small models on CPU.
+
+  The model is wrapped by `tf.make_template()`, so that its variables are
+  created once, within the variable scope `name`, and reused within the
+  loop.
+
+  Examples:
+  >>> def model_fn(features):
+  >>>   x, y = features
+  >>>   predictions = tf.layers.dense(x, 1)
+  >>>   loss = tf.losses.mean_squared_error(y, predictions)
+  >>>   return loss, {'mae': tf.reduce_mean(tf.abs(y - predictions))}
+  >>>
+  >>> dataset = tf.data.Dataset.from_tensor_slices((xs, ys))
+  >>> dataset = dataset.repeat().batch(32)
+  >>> trainer = MultiStepTrainer(model_fn, tf.train.AdamOptimizer(),
+  >>>                            dataset, n_steps_per_run=100)
+  >>> with tf.Session() as sess:
+  >>>   sess.run(tf.global_variables_initializer())
+  >>>   sess.run(trainer.initializer)
+  >>>   results = trainer.train(sess, n_runs=10, save_dir='ckpt',
+  >>>                           save_every_n_runs=5)
+
+  Args:
+    model_fn: Callable that maps the features given by the iterator of
+      `dataset` to either a scalar loss tensor, or a tuple of a scalar loss
+      tensor and a dictionary from metric name to scalar tensor.
+    optimizer: A `tf.train.Optimizer` instance.
+    dataset: A `tf.data.Dataset` instance. It shall provide at least
+      `n_steps_per_run` elements per run, e.g. by `dataset.repeat()`,
+      otherwise an `tf.errors.OutOfRangeError` raises.
+    n_steps_per_run: Positive integer.
+    global_step: Integer variable or `None`, as in
+      `tf.train.Optimizer.minimize()`.
+    name: String.
+  """
+
+  def __init__(self,
+               model_fn,
+               optimizer,
+               dataset,
+               n_steps_per_run,
+               global_step=None,
+               name='model'):
+    assert n_steps_per_run > 0
+    self._n_steps_per_run = n_steps_per_run
+    self._model_fn = tf.make_template(name, model_fn)
+    self._savers = {}  # from scope to `tf.train.Saver`.
+    self._iterator = dataset.make_initializable_iterator()
+
+    # Calling the model out of the while-loop creates the variables, since
+    # variables cannot be initialized within control-flow constructs. The
+    # resulting ops are never run.
+    loss, metrics = self._call_model_fn(self._iterator.get_next())
+    self._metric_names = sorted(metrics.keys())
+
+    def cond(step, *_):
+      return step < n_steps_per_run
+
+    def body(step, loss_sum, *metric_sums):
+      loss, metrics = self._call_model_fn(self._iterator.get_next())
+      train_op = optimizer.minimize(loss, global_step=global_step)
+      with tf.control_dependencies([train_op]):
+        metric_sums = [metric_sum + metrics[metric_name]
+                       for metric_sum, metric_name
+                       in zip(metric_sums, self._metric_names)]
+        return [step + 1, loss_sum + loss] + metric_sums
+
+    with tf.name_scope('{}_multi_step'.format(name)):
+      initial_values = [tf.constant(0),
+                        tf.zeros([], dtype=loss.dtype)]
+      initial_values += [tf.zeros([], dtype=metrics[metric_name].dtype)
+                         for metric_name in self._metric_names]
+      final_values = tf.while_loop(cond, body, initial_values,
+                                   back_prop=False)
+      _, loss_sum, *metric_sums = final_values
+
+      self._results = {'loss': loss_sum / n_steps_per_run}
+      for metric_name, metric_sum in zip(self._metric_names, metric_sums):
+        self._results[metric_name] = metric_sum / n_steps_per_run
+
+  @property
+  def initializer(self):
+    """Op that initializes the iterator of the dataset."""
+    return self._iterator.initializer
+
+  def run(self, session):
+    """Runs `n_steps_per_run` optimization steps within one
+    `session.run()`.
+
+    Args:
+      session: An instance of `tf.Session`.
+
+    Returns:
+      Dictionary with keys "loss", the metric names and "steps_per_sec".
+      The values of the loss and the metrics are averaged over the steps.
+    """
+    start = time.time()
+    results = session.run(self._results)
+    results['steps_per_sec'] = self._n_steps_per_run / (time.time() - start)
+    return results
+
+  def train(self,
+            session,
+            n_runs,
+            save_dir=None,
+            save_every_n_runs=None,
+            scope=ALL_VARS):
+    """Calls `self.run()` for `n_runs` times, and saves the variables
+    within the scope `scope` every `save_every_n_runs` runs, if `save_dir`
+    is not `None`, to the same checkpoint as `save_variables()`. The saver
+    is built once per scope, and reused by the later saves and calls, so
+    that saving adds no ops to the graph.
+
+    Args:
+      session: An instance of `tf.Session`.
+      n_runs: Positive integer.
+      save_dir: String or `None`.
+      save_every_n_runs: Positive integer or `None`. If `None` while
+        `save_dir` is not, then saves after the last run only.
+      scope: String or `ALL_VARS`.
+
+    Returns:
+      List of the returns of `self.run()`, one for each run.
+    """
+    if save_every_n_runs is None:
+      save_every_n_runs = n_runs
+
+    if save_dir is not None:
+      ensure_directory(save_dir)
+      ckpt_path = os.path.join(save_dir, get_ckpt_name(scope))
+
+    results = []
+    for i in range(n_runs):
+      results.append(self.run(session))
+      if save_dir is not None and (i + 1) % save_every_n_runs == 0:
+        self._get_saver(scope).save(session, ckpt_path)
+    return results
+
+  def _get_saver(self, scope):
+    if scope not in self._savers:
+      self._savers[scope] = tf.train.Saver(
+          tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope=scope))
+    return self._savers[scope]
+
+  def _call_model_fn(self, features):
+    outputs = self._model_fn(features)
+    if isinstance(outputs, tuple):
+      loss, metrics = outputs
+    else:
+      loss, metrics = outputs, {}
+    return loss, metrics
+
+
 def create_frugal_session(gpu_allocation=0.1):
   """Creates a session that occupies `gpu_allocation` percent GPU-memory only.
   Args:
@@ -88,6 +450,203 @@ def create_frugal_session(gpu_allocation=0.1):
   return tf.Session(config=config)
 
 
+def create_cpu_session(intra_op_threads=0,
+                       inter_op_threads=0,
+                       use_per_session_threads=False,
+                       optimize_graph=True,
+                       graph=None):
+  """Creates a session configured for CPU.
+
+  Notice that the intra-op thread-pool of the CPU device belongs to the
+  whole process, and its size is fixed by the first session created in the
+  process. So, `intra_op_threads` takes effect only if this is the first
+  session of the process.
+
+  Args:
+    intra_op_threads: Non-negative integer, as the number of threads used
+      for parallelizing the computation within an op, e.g. matmul. Zero
+      means letting TensorFlow decide.
+    inter_op_threads: Non-negative integer, as the number of threads used
+      for running independent ops in parallel. Zero means letting
+      TensorFlow decide.
+    use_per_session_threads: Boolean. If `False`, the inter-op thread-pool
+      is shared by all the sessions in the process, and is configured by the
+      first session created. If `True`, this session has its own inter-op
+      thread-pool of `inter_op_threads` threads.
+    optimize_graph: Boolean. If `True`, turns on the common subexpression
+      elimination, constant folding and function inlining of the graph.
+    graph: An instance of `tf.Graph` or `None`, as in `tf.Session`.
+
+  Returns:
+    An instance of `tf.Session`.
+  """
+  if optimize_graph:
+    opt_level = tf.OptimizerOptions.L1
+  else:
+    opt_level = tf.OptimizerOptions.L0
+  optimizer_options = tf.OptimizerOptions(
+      opt_level=opt_level, do_function_inlining=optimize_graph)
+  config = tf.ConfigProto(
+      device_count={'GPU': 0},
+      intra_op_parallelism_threads=intra_op_threads,
+      inter_op_parallelism_threads=inter_op_threads,
+      use_per_session_threads=use_per_session_threads,
+      graph_options=tf.GraphOptions(optimizer_options=optimizer_options))
+  return tf.Session(graph=graph, config=config)
+
+
+AUTOTUNE_CACHE_PATH = os.path.join(
+    os.path.expanduser('~'), '.tfutils', 'cpu_session_autotune.json')
+
+
+def autotune_cpu_session(step_fn,
+                         init_fn=None,
+                         intra_op_threads=0,
+                         candidates=None,
+                         n_warmup_steps=5,
+                         n_steps=20,
+                         cache_path=AUTOTUNE_CACHE_PATH,
+                         graph=None):
+  """Creates a session by `create_cpu_session()` with the number of
+  inter-op threads that runs `step_fn` fastest among the `candidates`.
+
+  Only the inter-op threads are tuned. Since the intra-op thread-pool
+  belongs to the whole process and is fixed by its first session (c.f.
+  `create_cpu_session()`), the intra-op threads cannot be compared within
+  one process. They are set by `intra_op_threads`, which takes effect only
+  if no session has been created in the process before. Each candidate,
+  as well as the returned session, has its own inter-op thread-pool.
+
+  The best number of inter-op threads is cached in the JSON file
+  `cache_path`, keyed by the fingerprint of the host and by
+  `intra_op_threads`, so that later jobs on the same host skip the
+  benchmarking.
+
+  Examples:
+  >>> train_op = ...
+  >>> sess = autotune_cpu_session(
+  >>>     step_fn=lambda sess: sess.run(train_op),
+  >>>     init_fn=lambda sess: sess.run(tf.global_variables_initializer()))
+
+  Args:
+    step_fn: Callable that maps a session to anything, as one step to
+      benchmark.
+    init_fn: Callable that maps a session to anything, called before
+      benchmarking each candidate, or `None`.
+    intra_op_threads: Non-negative integer, as in `create_cpu_session()`.
+    candidates: Non-empty list of positive integers, as the numbers of
+      inter-op threads, or `None`. If `None`, employs the candidates given
+      by `get_inter_op_thread_candidates()`.
+    n_warmup_steps: Non-negative integer.
+    n_steps: Positive integer, as the number of steps timed.
+    cache_path: String or `None`. If `None`, no cache is employed.
+    graph: An instance of `tf.Graph` or `None`, as in `tf.Session`.
+
+  Returns:
+    An instance of `tf.Session`, which has been initialized by `init_fn`
+    if `init_fn` is not `None`.
+
+  Raises:
+    ValueError: If `candidates` is empty.
+  """
+  if candidates is not None and not candidates:
+    raise ValueError('Arg `candidates` should not be empty.')
+
+  cache_key = '{}/intra_op_threads={}'.format(get_host_fingerprint(),
+                                              intra_op_threads)
+  cache = _load_autotune_cache(cache_path)
+
+  best = cache.get(cache_key)
+  if not (isinstance(best, dict) and 'inter_op_threads' in best):
+    if candidates is None:
+      candidates = get_inter_op_thread_candidates()
+
+    best = None
+    for inter_op_threads in candidates:
+      # Benchmarking with per-session threads, so that the shared
+      # inter-op thread-pool is not fixed by the first candidate.
+      with create_cpu_session(intra_op_threads,
+                              inter_op_threads,
+                              use_per_session_threads=True,
+                              graph=graph) as sess:
+        steps_per_sec = _benchmark_step_fn(sess, step_fn, init_fn,
+                                           n_warmup_steps, n_steps)
+      if best is None or steps_per_sec > best['steps_per_sec']:
+        best = {'inter_op_threads': inter_op_threads,
+                'steps_per_sec': steps_per_sec}
+
+    if cache_path is not None:
+      cache[cache_key] = best
+      _dump_autotune_cache(cache, cache_path)
+
+  sess = create_cpu_session(intra_op_threads,
+                            best['inter_op_threads'],
+                            use_per_session_threads=True,
+                            graph=graph)
+  if init_fn is not None:
+    init_fn(sess)
+  return sess
+
+
+def get_inter_op_thread_candidates():
+  """Returns the default candidates of the number of inter-op threads for
+  `autotune_cpu_session()`, based on the number of CPUs of the host.
+
+  Returns:
+    List of positive integers.
+  """
+  n_cpus = os.cpu_count() or 1
+  return sorted(set(n for n in (1, 2, n_cpus // 4, n_cpus // 2, n_cpus)
+                    if n > 0))
+
+
+def get_host_fingerprint():
+  """Returns a string that identifies the host and the TensorFlow version.
+
+  Returns:
+    String.
+  """
+  host_info = [platform.node(), platform.machine(), platform.processor(),
+               os.cpu_count(), tf.__version__]
+  return hashlib.sha1(json.dumps(host_info).encode('utf-8')).hexdigest()
+
+
+def _benchmark_step_fn(session, step_fn, init_fn, n_warmup_steps, n_steps):
+  """Auxillary function of `autotune_cpu_session()`. Returns the steps per
+  second of calling `step_fn` on `session`."""
+  if init_fn is not None:
+    init_fn(session)
+  for _ in range(n_warmup_steps):
+    step_fn(session)
+  start = time.time()
+  for _ in range(n_steps):
+    step_fn(session)
+  return n_steps / (time.time() - start)
+
+
+def _load_autotune_cache(cache_path):
+  """Auxillary function of `autotune_cpu_session()`. A corrupted cache is
+  regarded as empty, so that the tuning re-runs and then overwrites it."""
+  if cache_path is None or not os.path.exists(cache_path):
+    return {}
+  try:
+    with open(cache_path) as f:
+      cache = json.load(f)
+  except ValueError:  # including `json.JSONDecodeError`.
+    return {}
+  return cache if isinstance(cache, dict) else {}
+
+
+def _dump_autotune_cache(cache, cache_path):
+  """Auxillary function of `autotune_cpu_session()`. The file is replaced
+  atomically, so that concurrent jobs never read a partial cache."""
+  ensure_directory(os.path.dirname(os.path.abspath(cache_path)))
+  temp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+  with open(temp_path, 'w') as f:
+    json.dump(cache, f, indent=2)
+  os.replace(temp_path, cache_path)
+
+
 def smear(values, window_size):
     """Auxillary function for plotting. If the plot are bushing,
     e.g. plot of loss-values, smearing is called for.